@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+# Copyright 2017 Stanford University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+###
+### Generates an out-of-line CFFI module for the Legion C API
+###
+
+# Parsing legion_c.h is expensive, so it is done once here and the
+# result saved as the _legion_cffi module, which legion.py imports.
+# The module is rebuilt whenever any of the headers that go into it
+# (legion_c.h and the headers it includes) is newer than it.
+
+from __future__ import print_function
+
+import cffi
+import os
+
+module_name = '_legion_cffi'
+
+bindings_dir = os.path.dirname(os.path.realpath(__file__))
+root_dir = os.path.dirname(os.path.dirname(bindings_dir))
+runtime_dir = os.path.join(root_dir, 'runtime')
+legion_dir = os.path.join(runtime_dir, 'legion')
+header_path = os.path.join(legion_dir, 'legion_c.h')
+
+# Headers that legion_c.h pulls into the parsed declarations.
+# legion_defines.h is only present in CMake builds.
+dependency_paths = [
+    header_path,
+    os.path.join(legion_dir, 'legion_config.h'),
+    os.path.join(legion_dir, 'legion_defines.h'),
+    os.path.join(runtime_dir, 'realm', 'realm_c.h'),
+]
+
+def parse_header():
+    # Only needed when the module is (re)built, so avoid paying for
+    # these imports on every import of legion.py.
+    import re
+    import subprocess
+
+    header = subprocess.check_output(['gcc', '-I', runtime_dir, '-E', '-P', header_path])
+
+    # Hack: Fix for Ubuntu 16.04 versions of standard library headers:
+    header = re.sub(r'typedef struct {.+?} max_align_t;', '', header, flags=re.DOTALL)
+
+    return header
+
+def module_path(output_dir=bindings_dir):
+    return os.path.join(output_dir, '%s.py' % module_name)
+
+def is_up_to_date(output_dir=bindings_dir):
+    path = module_path(output_dir)
+    if not os.path.exists(path):
+        return False
+    # Installed copies may not ship the headers at all.
+    if not os.path.exists(header_path):
+        return True
+    header_mtime = max(
+        os.path.getmtime(dependency_path)
+        for dependency_path in dependency_paths
+        if os.path.exists(dependency_path))
+    return os.path.getmtime(path) >= header_mtime
+
+def build():
+    ffi = cffi.FFI()
+    ffi.cdef(parse_header())
+    # ABI mode: symbols are still resolved with dlopen at runtime,
+    # only the parsed declarations are saved.
+    ffi.set_source(module_name, None)
+    return ffi
+
+def save(ffi, output_dir=bindings_dir):
+    ffi.compile(tmpdir=output_dir)
+    # compile() leaves the module alone if its contents are unchanged,
+    # so touch it to keep is_up_to_date() from rebuilding every time.
+    os.utime(module_path(output_dir), None)
+
+if __name__ == '__main__':
+    save(build())
+    print('Wrote %s' % module_path())
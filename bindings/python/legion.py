@@ -17,30 +17,35 @@
 
 from __future__ import print_function
 
-import cffi
 import cPickle
 import collections
 import itertools
 import numpy
 import os
-import re
-import subprocess
+import struct
 import sys
 import threading
 
 _pickle_version = cPickle.HIGHEST_PROTOCOL # Use latest Pickle protocol
 
-root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
-runtime_dir = os.path.join(root_dir, 'runtime')
-legion_dir = os.path.join(runtime_dir, 'legion')
-
-header = subprocess.check_output(['gcc', '-I', runtime_dir, '-E', '-P', os.path.join(legion_dir, 'legion_c.h')])
-
-# Hack: Fix for Ubuntu 16.04 versions of standard library headers:
-header = re.sub(r'typedef struct {.+?} max_align_t;', '', header, flags=re.DOTALL)
-
-ffi = cffi.FFI()
-ffi.cdef(header)
+# Use the pre-parsed CFFI module for legion_c.h, regenerating it if the
+# headers have changed. If it can't be written (e.g. in a read-only
+# install), the declarations just parsed are used directly. Setting
+# LEGION_CFFI_PREBUILT skips the check and the builder altogether.
+if os.environ.get('LEGION_CFFI_PREBUILT'):
+    from _legion_cffi import ffi
+else:
+    import build_legion_cffi
+    if build_legion_cffi.is_up_to_date():
+        from _legion_cffi import ffi
+    else:
+        ffi = build_legion_cffi.build()
+        try:
+            build_legion_cffi.save(ffi)
+        except (IOError, OSError):
+            # Can't write the module (e.g. a read-only install), so it
+            # will be parsed again next time.
+            pass
 c = ffi.dlopen(None)
 
 # The Legion context is stored in thread-local storage. This assumes
@@ -48,6 +53,19 @@ c = ffi.dlopen(None)
 # corresponds to one and only one thread.
 _my = threading.local()
 
+# Dimension-specific entry points of the C API, indexed by dimension.
+_max_dim = 3
+def _c_functions_by_dim(name):
+    return dict((dim, getattr(c, name.format(dim)))
+                for dim in xrange(1, _max_dim + 1))
+_domain_from_rect = _c_functions_by_dim('legion_domain_from_rect_{}d')
+_domain_get_rect = _c_functions_by_dim('legion_domain_get_rect_{}d')
+_get_field_accessor = _c_functions_by_dim(
+    'legion_physical_region_get_field_accessor_array_{}d')
+_raw_rect_ptr = _c_functions_by_dim('legion_accessor_array_{}d_raw_rect_ptr')
+_rect_ptr_type = dict((dim, ffi.typeof('legion_rect_{}d_t *'.format(dim)))
+                      for dim in xrange(1, _max_dim + 1))
+
 class Context(object):
     __slots__ = ['context_root', 'context', 'runtime_root', 'runtime',
                  'task_root', 'task', 'regions', 'current_launch']
@@ -71,9 +89,8 @@ class DomainPoint(object):
     __slots__ = ['impl']
     def __init__(self, value):
         assert(isinstance(value, _IndexValue))
-        self.impl = ffi.new('legion_domain_point_t *')
-        self.impl[0].dim = 1
-        self.impl[0].point_data[0] = int(value)
+        self.impl = ffi.new('legion_domain_point_t *',
+                            {'dim': 1, 'point_data': [int(value)]})
     def raw_value(self):
         return self.impl[0]
 
@@ -83,25 +100,44 @@ class Domain(object):
         if start is not None:
             assert len(start) == len(extent)
         else:
-            start = [0 for _ in extent]
-        assert 1 <= len(extent) <= 3
-        rect = ffi.new('legion_rect_{}d_t *'.format(len(extent)))
-        for i in xrange(len(extent)):
-            rect[0].lo.x[i] = start[i]
-            rect[0].hi.x[i] = start[i] + extent[i] - 1
-        self.impl = getattr(c, 'legion_domain_from_rect_{}d'.format(len(extent)))(rect[0])
+            start = [0] * len(extent)
+        assert 1 <= len(extent) <= _max_dim
+        hi = [lo + size - 1 for lo, size in zip(start, extent)]
+        rect = ffi.new(_rect_ptr_type[len(extent)], [[start], [hi]])
+        self.impl = _domain_from_rect[len(extent)](rect[0])
     def raw_value(self):
         return self.impl
 
+# Size and pointer type of each typed Future value, keyed by C type.
+_future_value_types = {}
+def _future_value_type(value_type):
+    if value_type not in _future_value_types:
+        _future_value_types[value_type] = (
+            ffi.sizeof(value_type),
+            ffi.typeof(ffi.getctype(value_type, '*')))
+    return _future_value_types[value_type]
+
 class Future(object):
     __slots__ = ['handle', 'value_type']
     def __init__(self, handle, value_type=None):
         self.handle = c.legion_future_copy(handle)
         self.value_type = value_type
 
+    @classmethod
+    def _take(cls, handle, value_type=None):
+        # Important: Assumes ownership of handle. Do NOT copy.
+        future = cls.__new__(cls)
+        future.handle = handle
+        future.value_type = value_type
+        return future
+
     def __del__(self):
         c.legion_future_destroy(self.handle)
 
+    def wait(self):
+        # Blocks until the future is ready without retrieving its value.
+        c.legion_future_get_void_result(self.handle)
+
     def get(self):
         if self.value_type is None:
             value_ptr = c.legion_future_get_untyped_pointer(self.handle)
@@ -111,12 +147,12 @@ class Future(object):
             value = cPickle.loads(value_str)
             return value
         else:
-            expected_size = ffi.sizeof(self.value_type)
+            expected_size, value_ptr_type = _future_value_type(self.value_type)
 
             value_ptr = c.legion_future_get_untyped_pointer(self.handle)
             value_size = c.legion_future_get_untyped_size(self.handle)
             assert value_size == expected_size
-            value = ffi.cast(ffi.getctype(self.value_type, '*'), value_ptr)[0]
+            value = ffi.cast(value_ptr_type, value_ptr)[0]
             return value
 
 class Type(object):
@@ -141,12 +177,16 @@ uint32 = Type(numpy.uint32)
 uint64 = Type(numpy.uint64)
 
 class Privilege(object):
-    __slots__ = ['read', 'write', 'discard']
+    __slots__ = ['read', 'write', 'discard', '_bits']
 
     def __init__(self, read=False, write=False, discard=False):
         self.read = read
         self.write = write
         self.discard = discard
+        # Privileges are immutable, so compute the Legion privilege
+        # bits up front: WRITE_DISCARD, READ_WRITE, READ_ONLY or NO_ACCESS.
+        assert write or not discard
+        self._bits = 2 if discard else (7 if write else (1 if read else 0))
 
     def _fields(self):
         return (self.read, self.write, self.discard)
@@ -159,20 +199,23 @@ class Privilege(object):
         return self._fields().__cmp__(other._fields())
 
     def __hash__(self):
-        return hash(self._fields())
+        # Equal privileges always have equal bits.
+        return self._bits
 
     def __call__(self, fields):
-        return PrivilegeFields(self, fields)
+        # Privilege annotations are usually written inline in task
+        # declarations, so intern them rather than allocating a new
+        # PrivilegeFields for every occurrence.
+        fields = frozenset(fields)
+        key = (self._fields(), fields)
+        if key not in _privilege_fields:
+            _privilege_fields[key] = PrivilegeFields(self, fields)
+        return _privilege_fields[key]
 
     def _legion_privilege(self):
-        bits = 0
-        if self.discard:
-            assert self.write
-            bits |= 2 # WRITE_DISCARD
-        else:
-            if self.write: bits = 7 # READ_WRITE
-            elif self.read: bits = 1 # READ_ONLY
-        return bits
+        return self._bits
+
+_privilege_fields = {}
 
 class PrivilegeFields(Privilege):
     __slots__ = ['read', 'write', 'discard', 'fields']
@@ -197,11 +240,12 @@ def _Ispace_unpickle(ispace_tid, ispace_id, ispace_type_tag):
     return Ispace(handle[0])
 
 class Ispace(object):
-    __slots__ = ['handle']
+    __slots__ = ['handle', '_cached_domain']
 
     def __init__(self, handle):
         # Important: Copy handle. Do NOT assume ownership.
         self.handle = ffi.new('legion_index_space_t *', handle)
+        self._cached_domain = None
 
     def __reduce__(self):
         return (_Ispace_unpickle,
@@ -209,6 +253,14 @@ class Ispace(object):
                  self.handle[0].id,
                  self.handle[0].type_tag))
 
+    def domain(self):
+        # The domain of an index space never changes, so it only
+        # needs to be fetched from the runtime once.
+        if self._cached_domain is None:
+            self._cached_domain = c.legion_index_space_get_domain(
+                _my.ctx.runtime, self.handle[0])
+        return self._cached_domain
+
     @staticmethod
     def create(extent, start=None):
         domain = Domain(extent, start=start).raw_value()
@@ -241,18 +293,19 @@ class Fspace(object):
         handle = c.legion_field_space_create(_my.ctx.runtime, _my.ctx.context)
         alloc = c.legion_field_allocator_create(
             _my.ctx.runtime, _my.ctx.context, handle)
+        allocate_field = c.legion_field_allocator_allocate_field
+        attach_name = c.legion_field_id_attach_name
+        runtime = _my.ctx.runtime
+        auto_id = ffi.cast('legion_field_id_t', -1) # AUTO_GENERATE_ID
         field_ids = {}
         field_types = {}
-        for field_name, field_entry in fields.items():
-            try:
+        for field_name, field_entry in fields.iteritems():
+            if isinstance(field_entry, tuple):
                 field_type, field_id = field_entry
-            except TypeError:
-                field_type = field_entry
-                field_id = ffi.cast('legion_field_id_t', -1) # AUTO_GENERATE_ID
-            field_id = c.legion_field_allocator_allocate_field(
-                alloc, field_type.size, field_id)
-            c.legion_field_id_attach_name(
-                _my.ctx.runtime, handle, field_id, field_name, False)
+            else:
+                field_type, field_id = field_entry, auto_id
+            field_id = allocate_field(alloc, field_type.size, field_id)
+            attach_name(runtime, handle, field_id, field_name, False)
             field_ids[field_name] = field_id
             field_types[field_name] = field_type
         c.legion_field_allocator_destroy(alloc)
@@ -280,6 +333,7 @@ class Region(object):
         self.instances = {}
         self.privileges = {}
         self.instance_wrappers = {}
+        self.__class__ = _region_class(fspace)
 
     def __reduce__(self):
         return (_Region_unpickle,
@@ -324,73 +378,96 @@ class Region(object):
             self.privileges[field_name] = privilege
 
     def map_inline(self):
-        fields_by_privilege = collections.defaultdict(set)
+        # Group fields by their Legion privilege bits, so that fields
+        # with equivalent privileges are mapped together.
+        fields_by_privilege = {}
         for field_name, privilege in self.privileges.iteritems():
-            fields_by_privilege[privilege].add(field_name)
-        for privilege, field_names  in fields_by_privilege.iteritems():
+            fields_by_privilege.setdefault(
+                privilege._legion_privilege(), []).append(field_name)
+        field_ids = self.fspace.field_ids
+        add_field = c.legion_inline_launcher_add_field
+        for privilege, field_names in fields_by_privilege.iteritems():
             launcher = c.legion_inline_launcher_create_logical_region(
                 self.handle[0],
-                privilege._legion_privilege(), 0, # EXCLUSIVE
+                privilege, 0, # EXCLUSIVE
                 self.handle[0],
                 0, False, 0, 0)
             for field_name in field_names:
-                c.legion_inline_launcher_add_field(
-                    launcher, self.fspace.field_ids[field_name], True)
+                add_field(launcher, field_ids[field_name], True)
             instance = c.legion_inline_launcher_execute(
                 _my.ctx.runtime, _my.ctx.context, launcher)
             for field_name in field_names:
                 self.set_instance(field_name, instance)
 
+    def _get_field(self, field_name):
+        if field_name not in self.instances:
+            if self.privileges[field_name] is None:
+                raise Exception('Invalid attempt to access field "%s" without privileges' % field_name)
+            self.map_inline()
+        if field_name not in self.instance_wrappers:
+            self.instance_wrappers[field_name] = RegionField(
+                self, field_name)
+        return self.instance_wrappers[field_name]
+
     def __getattr__(self, field_name):
         if field_name in self.fspace.field_ids:
-            if field_name not in self.instances:
-                if self.privileges[field_name] is None:
-                    raise Exception('Invalid attempt to access field "%s" without privileges' % field_name)
-                self.map_inline()
-            if field_name not in self.instance_wrappers:
-                self.instance_wrappers[field_name] = RegionField(
-                    self, field_name)
-            return self.instance_wrappers[field_name]
+            return self._get_field(field_name)
         else:
             raise AttributeError()
 
+# Fields are normally accessed through properties on a subclass of
+# Region specific to the set of field names, which avoids the cost of
+# going through __getattr__. Fields whose names clash with attributes
+# of Region itself are still reached via __getattr__.
+_region_classes = {}
+
+def _region_field_property(field_name):
+    return property(lambda self: self._get_field(field_name))
+
+def _region_class(fspace):
+    field_names = frozenset(fspace.field_ids.keys())
+    if field_names not in _region_classes:
+        members = {'__slots__': ()}
+        for field_name in field_names:
+            if not hasattr(Region, field_name):
+                members[field_name] = _region_field_property(field_name)
+        _region_classes[field_names] = type('Region', (Region,), members)
+    return _region_classes[field_names]
+
 class RegionField(numpy.ndarray):
     # NumPy requires us to implement __new__ for subclasses of ndarray:
     # https://docs.scipy.org/doc/numpy/user/basics.subclassing.html
     def __new__(cls, region, field_name):
-        accessor = RegionField._get_accessor(region, field_name)
-        initializer = RegionField._get_array_initializer(region, field_name, accessor)
+        domain = region.ispace.domain()
+        accessor = RegionField._get_accessor(region, field_name, domain)
+        initializer = RegionField._get_array_initializer(
+            region, field_name, accessor, domain)
         obj = numpy.asarray(initializer).view(cls)
 
         obj.accessor = accessor
         return obj
 
     @staticmethod
-    def _get_accessor(region, field_name):
+    def _get_accessor(region, field_name, domain):
         # Note: the accessor needs to be kept alive, to make sure to
         # save the result of this function in an instance variable.
         instance = region.instances[field_name]
-        domain = c.legion_index_space_get_domain(
-            _my.ctx.runtime, region.ispace.handle[0])
-        dim = domain.dim
-        get_accessor = getattr(c, 'legion_physical_region_get_field_accessor_array_{}d'.format(dim))
-        return get_accessor(instance, region.fspace.field_ids[field_name])
+        return _get_field_accessor[domain.dim](
+            instance, region.fspace.field_ids[field_name])
 
     @staticmethod
-    def _get_base_and_stride(region, field_name, accessor):
-        domain = c.legion_index_space_get_domain(
-            _my.ctx.runtime, region.ispace.handle[0])
+    def _get_base_and_stride(region, field_name, accessor, domain):
         dim = domain.dim
-        rect = getattr(c, 'legion_domain_get_rect_{}d'.format(dim))(domain)
-        subrect = ffi.new('legion_rect_{}d_t *'.format(dim))
+        rect = _domain_get_rect[dim](domain)
+        subrect = ffi.new(_rect_ptr_type[dim])
         offsets = ffi.new('legion_byte_offset_t[]', dim)
 
-        base_ptr = getattr(c, 'legion_accessor_array_{}d_raw_rect_ptr'.format(dim))(
-            accessor, rect, subrect, offsets)
+        base_ptr = _raw_rect_ptr[dim](accessor, rect, subrect, offsets)
         assert base_ptr
-        for i in xrange(dim):
-            assert subrect[0].lo.x[i] == rect.lo.x[i]
-            assert subrect[0].hi.x[i] == rect.hi.x[i]
+
+        # The accessor must cover the whole rect; compare the two
+        # rects as raw bytes rather than one coordinate at a time.
+        assert ffi.buffer(subrect)[:] == ffi.buffer(ffi.addressof(rect))[:]
         assert offsets[0].offset == region.fspace.field_types[field_name].size
 
         shape = tuple(rect.hi.x[i] - rect.lo.x[i] + 1 for i in xrange(dim))
@@ -399,9 +476,9 @@ class RegionField(numpy.ndarray):
         return base_ptr, shape, strides
 
     @staticmethod
-    def _get_array_initializer(region, field_name, accessor):
+    def _get_array_initializer(region, field_name, accessor, domain):
         base_ptr, shape, strides = RegionField._get_base_and_stride(
-            region, field_name, accessor)
+            region, field_name, accessor, domain)
         field_type = region.fspace.field_types[field_name]
 
         # Numpy doesn't know about CFFI pointers, so we have to cast
@@ -447,13 +524,95 @@ class ExternTask(object):
 def extern_task(**kwargs):
     return ExternTask(**kwargs)
 
+# Region arguments to JIT-compiled tasks are passed as named tuples of
+# their field arrays, which Numba understands natively. One tuple type
+# is created per distinct set of field names.
+_jit_region_types = {}
+
+def _jit_region_type(field_names):
+    if field_names not in _jit_region_types:
+        region_type = collections.namedtuple(
+            'JitRegion', field_names, rename=True)
+        # Field names that aren't valid attribute names (e.g. keywords
+        # or names starting with '_') get renamed, so the body would
+        # be unable to refer to them. Such regions aren't supported.
+        if region_type._fields != field_names:
+            region_type = None
+        _jit_region_types[field_names] = region_type
+    return _jit_region_types[field_names]
+
+def _jit_task_arguments(args):
+    jit_args = []
+    for arg in args:
+        if isinstance(arg, Region):
+            # Only fields the task has access to, as getting an
+            # accessor to a field without privileges is invalid.
+            field_names = tuple(sorted(
+                field_name for field_name in arg.instances
+                if arg.privileges[field_name]._legion_privilege() != 0))
+            region_type = _jit_region_type(field_names)
+            if region_type is None:
+                return None
+            arg = region_type(
+                *[getattr(arg, field_name).view(numpy.ndarray)
+                  for field_name in field_names])
+        jit_args.append(arg)
+    return jit_args
+
+def _jit_compile(body):
+    # Numba is an optional dependency, so only import it on demand.
+    import numba
+    return numba.njit(cache=True, fastmath=True)(body)
+
+def _jit_typing_error():
+    try:
+        from numba.core.errors import TypingError
+    except ImportError:
+        from numba.errors import TypingError
+    return TypingError
+
+def _privileged_field_names(privilege, fspace):
+    if hasattr(privilege, 'fields'):
+        assert set(privilege.fields) <= set(fspace.field_ids.keys())
+        return [name for name in fspace.field_ids.iterkeys()
+                if name in privilege.fields]
+    return fspace.field_ids.keys()
+
+def _decode_args(arg_ptr, arg_size):
+    if arg_size == 0:
+        return ()
+    return cPickle.loads(ffi.unpack(ffi.cast('char *', arg_ptr), arg_size))
+
+# Tags the local arguments of an index launch point that only carry
+# the index, packed as an int64. (Pickles always start with '\x80'.)
+_index_tag = b'i'
+_index_struct = struct.Struct('<q')
+
+def _decode_index_args(task):
+    # See _IndexLauncher.attach_local_args for how these are encoded.
+    local_str = ffi.unpack(
+        ffi.cast('char *', c.legion_task_get_local_args(task)),
+        c.legion_task_get_local_arglen(task))
+    if local_str[:1] != _index_tag:
+        return cPickle.loads(local_str)
+    index = _index_struct.unpack_from(local_str, 1)[0]
+    args, index_positions = _decode_args(
+        c.legion_task_get_args(task),
+        c.legion_task_get_arglen(task))
+    args = list(args)
+    for i in index_positions:
+        args[i] = index
+    return tuple(args)
+
 class Task (object):
-    __slots__ = ['body', 'privileges', 'leaf', 'inner', 'idempotent', 'calling_convention', 'task_id']
+    __slots__ = ['body', 'jit_body', 'privileges', 'leaf', 'inner', 'idempotent',
+                 'calling_convention', 'task_id', 'region_fields']
 
     def __init__(self, body, privileges=None,
                  leaf=False, inner=False, idempotent=False,
-                 register=True):
+                 jit=False, register=True):
         self.body = body
+        self.jit_body = _jit_compile(body) if jit else None
         if privileges is not None:
             privileges = [(x if x is not None else N) for x in privileges]
         self.privileges = privileges
@@ -462,6 +621,7 @@ class Task (object):
         self.idempotent = bool(idempotent)
         self.calling_convention = 'python'
         self.task_id = None
+        self.region_fields = {}
         if register:
             self.register()
 
@@ -485,7 +645,8 @@ class Task (object):
         return TaskLaunch().spawn_task(self, *args)
 
     def execute_task(self, raw_args, user_data, proc):
-        raw_arg_ptr = ffi.new('char[]', bytes(raw_args))
+        # Note: raw_args must stay alive as long as this pointer is used.
+        raw_arg_ptr = ffi.from_buffer(raw_args)
         raw_arg_size = len(raw_args)
 
         # Execute preamble to obtain Legion API context.
@@ -498,40 +659,41 @@ class Task (object):
             raw_arg_ptr, raw_arg_size, proc,
             task, raw_regions, num_regions, context, runtime)
 
-        # Decode arguments from Pickle format.
+        # Decode arguments.
         if c.legion_task_get_is_index_space(task[0]):
-            arg_ptr = ffi.cast('char *', c.legion_task_get_local_args(task[0]))
-            arg_size = c.legion_task_get_local_arglen(task[0])
+            args = _decode_index_args(task[0])
         else:
-            arg_ptr = ffi.cast('char *', c.legion_task_get_args(task[0]))
-            arg_size = c.legion_task_get_arglen(task[0])
-
-        if arg_size > 0:
-            args = cPickle.loads(ffi.unpack(arg_ptr, arg_size))
-        else:
-            args = ()
+            args = _decode_args(
+                c.legion_task_get_args(task[0]),
+                c.legion_task_get_arglen(task[0]))
 
         # Unpack regions.
+        region_count = num_regions[0]
         regions = []
-        for i in xrange(num_regions[0]):
+        for i in xrange(region_count):
             regions.append(raw_regions[0][i])
 
         # Unpack physical regions.
         if self.privileges is not None:
+            privilege_count = len(self.privileges)
             req = 0
-            for i, arg in zip(range(len(args)), args):
+            for i, arg in enumerate(args):
                 if isinstance(arg, Region):
-                    assert req < num_regions[0] and req < len(self.privileges)
+                    assert req < region_count and req < privilege_count
                     instance = raw_regions[0][req]
                     req += 1
 
                     priv = self.privileges[i]
-                    if hasattr(priv, 'fields'):
-                        assert set(priv.fields) <= set(arg.fspace.field_ids.keys())
-                    for name, fid in arg.fspace.field_ids.items():
-                        if not hasattr(priv, 'fields') or name in priv.fields:
-                            arg.set_instance(name, instance, priv)
-            assert req == num_regions[0]
+                    # The fields to unpack depend only on the argument
+                    # position and the field space, so compute them once.
+                    key = (i, arg.fspace.handle[0].id)
+                    field_names = self.region_fields.get(key)
+                    if field_names is None:
+                        field_names = _privileged_field_names(priv, arg.fspace)
+                        self.region_fields[key] = field_names
+                    for name in field_names:
+                        arg.set_instance(name, instance, priv)
+            assert req == region_count
 
         # Build context.
         ctx = Context(context, runtime, task, regions)
@@ -549,14 +711,18 @@ class Task (object):
         _my.ctx = ctx
 
         # Execute task body.
-        result = self.body(*args)
+        if self.jit_body is not None:
+            result = self.execute_jit_body(*args)
+        else:
+            result = self.body(*args)
 
         # Encode result in Pickle format.
         if result is not None:
             result_str = cPickle.dumps(result, protocol=_pickle_version)
             result_size = len(result_str)
-            result_ptr = ffi.new('char[]', result_size)
-            ffi.buffer(result_ptr, result_size)[:] = result_str
+            # The postamble copies the result, so there is no need to
+            # copy it into a buffer of our own first.
+            result_ptr = ffi.from_buffer(result_str)
         else:
             result_size = 0
             result_ptr = ffi.NULL
@@ -567,6 +733,17 @@ class Task (object):
         # Clear thread-local storage.
         del _my.ctx
 
+    def execute_jit_body(self, *args):
+        jit_args = _jit_task_arguments(args)
+        if jit_args is not None:
+            try:
+                return self.jit_body(*jit_args)
+            except _jit_typing_error():
+                # Numba is unable to compile the body for these
+                # arguments. Fall back to Python from here on.
+                self.jit_body = None
+        return self.body(*args)
+
     def register(self):
         assert(self.task_id is None)
 
@@ -604,6 +781,11 @@ def task(body=None, **kwargs):
         return lambda body: task(body, **kwargs)
     return Task(body, **kwargs)
 
+def kernel(body=None, **kwargs):
+    if body is None:
+        return lambda body: kernel(body, **kwargs)
+    return Task(body, jit=True, **kwargs)
+
 class _TaskLauncher(object):
     __slots__ = ['task_id', 'privileges', 'calling_convention']
 
@@ -643,21 +825,19 @@ class _TaskLauncher(object):
         # Construct the task launcher.
         launcher = c.legion_task_launcher_create(
             self.task_id, task_args[0], c.legion_predicate_true(), 0, 0)
-        for i, arg in zip(range(len(args)), args):
+        privilege_count = len(self.privileges) if self.privileges is not None else 0
+        for i, arg in enumerate(args):
             if isinstance(arg, Region):
-                assert i < len(self.privileges)
+                assert i < privilege_count
                 priv = self.privileges[i]
                 req = c.legion_task_launcher_add_region_requirement_logical_region(
                     launcher, arg.handle[0],
                     priv._legion_privilege(),
                     0, # EXCLUSIVE
                     arg.handle[0], 0, False)
-                if hasattr(priv, 'fields'):
-                    assert set(priv.fields) <= set(arg.fspace.field_ids.keys())
-                for name, fid in arg.fspace.field_ids.items():
-                    if not hasattr(priv, 'fields') or name in priv.fields:
-                        c.legion_task_launcher_add_field(
-                            launcher, req, fid, True)
+                for name in _privileged_field_names(priv, arg.fspace):
+                    c.legion_task_launcher_add_field(
+                        launcher, req, arg.fspace.field_ids[name], True)
             elif self.calling_convention is None:
                 # FIXME: Task arguments aren't being encoded AT ALL;
                 # at least throw an exception so that the user knows
@@ -669,19 +849,30 @@ class _TaskLauncher(object):
         c.legion_task_launcher_destroy(launcher)
 
         # Build future of result.
-        future = Future(result)
-        c.legion_future_destroy(result)
-        return future
+        return Future._take(result)
+
+# Arguments of these types pickle identically as long as they are the
+# same object.
+_immutable_arg_types = (type(None), bool, int, long, float, str,
+                        Type, Ispace, Fspace, Region)
 
 class _IndexLauncher(_TaskLauncher):
     __slots__ = ['task_id', 'privileges', 'calling_convention',
-                 'domain', 'local_args']
+                 'domain', 'local_args', 'point',
+                 'saved_args', 'shared_args', 'index_positions']
 
     def __init__(self, task_id, privileges, calling_convention, domain):
         super(_IndexLauncher, self).__init__(
             task_id, privileges, calling_convention)
         self.domain = domain
         self.local_args = c.legion_argument_map_create()
+        # The argument map copies points, so one point can be reused
+        # for every call to attach_local_args.
+        self.point = ffi.new('legion_domain_point_t *')
+        self.point[0].dim = 1
+        self.saved_args = None
+        self.shared_args = None
+        self.index_positions = None
 
     def __del__(self):
         c.legion_argument_map_destroy(self.local_args)
@@ -689,18 +880,62 @@ class _IndexLauncher(_TaskLauncher):
     def spawn_task(self, *args):
         raise Exception('IndexLaunch does not support spawn_task')
 
+    def share_args(self, index, args):
+        # Arguments broadcast to every point of the launch are usually
+        # the very same objects at each point, with only the index
+        # varying. If so, they are pickled once into the global
+        # arguments, with the positions of the index left empty.
+        if self.saved_args is None:
+            self.saved_args = args
+            self.index_positions = tuple(
+                i for i, arg in enumerate(args) if arg is index)
+            if all(arg is index or isinstance(arg, _immutable_arg_types)
+                   for arg in args):
+                self.shared_args = tuple(
+                    None if arg is index else arg for arg in args)
+        if self.shared_args is None or len(args) != len(self.saved_args):
+            return False
+        for arg, saved_arg in itertools.izip(args, self.saved_args):
+            if arg is not saved_arg:
+                return False
+        return True
+
     def attach_local_args(self, index, *args):
-        point = DomainPoint(index)
-        args = self.preprocess_args(*args)
-        task_args, _ = self.encode_args(*args)
+        self.point[0].point_data[0] = int(index)
+        if self.calling_convention == 'python':
+            # Local arguments are either just the index, to be filled
+            # into the shared global arguments, or the full arguments.
+            # The former is the common case (e.g. the index is the
+            # only argument), so it is packed directly, not pickled.
+            if self.share_args(index, args):
+                arg_str = _index_tag + _index_struct.pack(int(index))
+            else:
+                arg_str = cPickle.dumps(
+                    tuple(self.preprocess_args(*args)),
+                    protocol=_pickle_version)
+            arg_buffer = ffi.from_buffer(arg_str)
+            task_args = ffi.new('legion_task_argument_t *')
+            task_args[0].args = arg_buffer
+            task_args[0].arglen = len(arg_str)
+        else:
+            args = self.preprocess_args(*args)
+            task_args, _ = self.encode_args(*args)
         c.legion_argument_map_set_point(
-            self.local_args, point.raw_value(), task_args[0], False)
+            self.local_args, self.point[0], task_args[0], False)
 
     def launch(self):
-        # All arguments are passed as local, so global is NULL.
         global_args = ffi.new('legion_task_argument_t *')
-        global_args[0].args = ffi.NULL
-        global_args[0].arglen = 0
+        global_args_buffer = None
+        if self.shared_args is not None:
+            global_str = cPickle.dumps(
+                (self.shared_args, self.index_positions),
+                protocol=_pickle_version)
+            global_args_buffer = ffi.from_buffer(global_str)
+            global_args[0].args = global_args_buffer
+            global_args[0].arglen = len(global_str)
+        else:
+            global_args[0].args = ffi.NULL
+            global_args[0].arglen = 0
 
         # Construct the task launcher.
         launcher = c.legion_index_launcher_create(
@@ -786,7 +1021,9 @@ class IndexLaunch(object):
 
         if self.saved_args is None:
             self.saved_args = args
-        for arg, saved_arg in itertools.izip_longest(args, self.saved_args):
+        if len(args) != len(self.saved_args):
+            raise Exception('An IndexLaunch must pass the same number of arguments at every point')
+        for arg, saved_arg in itertools.izip(args, self.saved_args):
             # TODO: Add support for region arguments
             if isinstance(arg, Region) or isinstance(arg, RegionField):
                 raise Exception('TODO: Support region arguments to an IndexLaunch')
@@ -801,14 +1038,17 @@ class IndexLaunch(object):
     def launch(self):
         self.launcher.launch()
 
+# The C API has no way to wait on an execution fence, so a blocking
+# fence waits on this task instead. It returns nothing, so there is no
+# result to encode or decode.
 @task(leaf=True)
 def _dummy_task():
-    return 1
+    pass
 
 def execution_fence(block=False):
     c.legion_runtime_issue_execution_fence(_my.ctx.runtime, _my.ctx.context)
     if block:
-        _dummy_task().get()
+        _dummy_task().wait()
 
 class Tunable(object):
     # FIXME: Deduplicate this with DefaultMapper::DefaultTunables
@@ -824,10 +1064,19 @@ class Tunable(object):
     GLOBAL_OMPS = 9
     GLOBAL_PYS = 10
 
+    # Tunable values don't change over the life of the process, so the
+    # future for each one is shared. Set LEGION_NO_TUNABLE_CACHE to
+    # query the mapper on every call instead.
+    _cache = {}
+    _use_cache = not os.environ.get('LEGION_NO_TUNABLE_CACHE')
+
     @staticmethod
     def select(tunable_id):
-        result = c.legion_runtime_select_tunable_value(
-            _my.ctx.runtime, _my.ctx.context, tunable_id, 0, 0)
-        future = Future(result, 'size_t')
-        c.legion_future_destroy(result)
+        future = Tunable._cache.get(tunable_id)
+        if future is None:
+            result = c.legion_runtime_select_tunable_value(
+                _my.ctx.runtime, _my.ctx.context, tunable_id, 0, 0)
+            future = Future._take(result, 'size_t')
+            if Tunable._use_cache:
+                Tunable._cache[tunable_id] = future
         return future
@@ -21,10 +21,15 @@
 
 from __future__ import print_function
 
-import datetime, json, os, re, sys, subprocess
+import datetime, errno, json, multiprocessing.pool, os, re, sys, subprocess, tempfile, time
 
 import github3 # Requires: pip install github3.py
 
+try:
+    from orjson import loads as json_loads # Optional: pip install orjson
+except ImportError:
+    from json import loads as json_loads
+
 def cmd(command, env=None, cwd=None):
     print(' '.join(command))
     return subprocess.check_output(command, env=env, cwd=cwd)
@@ -33,9 +38,28 @@ def get_repository(owner, repository, token):
     session = github3.login(token=token)
     return session.repository(owner=owner, repository=repository)
 
-def create_result_file(repo, path, result):
-    content = json.dumps(result)
-    repo.create_file(path, 'Add measurement %s.' % path, content)
+def save_result_file(directory, path, content):
+    local_path = os.path.join(directory, path)
+    try:
+        os.makedirs(os.path.dirname(local_path))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    with open(local_path, 'w') as f:
+        f.write(content)
+    return local_path
+
+def create_result_file(repo, path, content, retries=5):
+    # Retry server-side failures with exponential backoff so that a
+    # transient Github error doesn't cost us the measurement.
+    for attempt in range(retries):
+        try:
+            repo.create_file(path, 'Add measurement %s.' % path, content)
+            return
+        except github3.GitHubError as e:
+            if e.code < 500 or attempt == retries - 1:
+                raise
+            time.sleep(2 ** attempt)
 
 class ArgvMeasurement(object):
     __slots__ = ['start', 'index', 'filter']
@@ -45,25 +69,31 @@ class ArgvMeasurement(object):
         self.start = int(start) if start is not None else None
         self.index = int(index) if index is not None else None
         if filter is None:
-            self.filter = lambda x: x
+            self.filter = None
         elif filter == "basename":
             self.filter = os.path.basename
         else:
             raise Exception('Unrecognized filter "%s"' % filter)
     def measure(self, argv, output):
         if self.start is not None:
-            return [self.filter(x) for x in argv[self.start:]]
+            result = argv[self.start:]
+            if self.filter is None:
+                return result
+            return [self.filter(x) for x in result]
         elif self.index is not None:
-            return self.filter(argv[self.index])
+            result = argv[self.index]
+            if self.filter is None:
+                return result
+            return self.filter(result)
         else:
             assert False
 
 class RegexMeasurement(object):
     __slots__ = ['pattern']
     def __init__(self, pattern=None, multiline=None):
-        self.pattern = re.compile(pattern, re.MULTILINE if multiline else None)
+        self.pattern = re.compile(pattern, re.MULTILINE if multiline else 0)
     def measure(self, argv, output):
-        match = re.search(self.pattern, output)
+        match = self.pattern.search(output)
         if match is None:
             raise Exception('Regex match failed')
         result = match.group(1).strip()
@@ -92,34 +122,38 @@ measurement_types = {
     'command': CommandMeasurement,
 }
 
-def strip_type(type=None, **kwargs):
-    return kwargs
-
-def get_measurement(value, argv, output):
+def parse_measurement(value):
     if 'type' not in value:
         raise Exception('Malformed measurement: Needs field "type"')
-    if value['type'] not in measurement_types:
+    measurement = measurement_types.get(value['type'])
+    if measurement is None:
         raise Exception(
             'Malformed measurement: Unrecognized type "%s"' % value['type'])
-    measurement = measurement_types[value['type']]
-    return measurement(**strip_type(**value)).measure(argv, output)
+    kwargs = dict((k, v) for k, v in value.items() if k != 'type')
+    return measurement(**kwargs)
 
-def get_variable(name, description):
-    if name not in os.environ:
+def get_variable(env, name, description, default=None):
+    value = env.get(name, default)
+    if value is None:
         raise Exception(
             'Please set environment variable %s to %s' % (name, description))
-    return os.environ[name]
+    return value
 
 def driver():
-    # Parse inputs.
-    owner = get_variable('PERF_OWNER', 'Github respository owner')
-    repository = get_variable('PERF_REPOSITORY', 'Github respository name')
-    access_token = get_variable('PERF_ACCESS_TOKEN', 'Github access token')
-    metadata = json.loads(
-        get_variable('PERF_METADATA', 'JSON-encoded metadata'))
-    measurements = json.loads(
-        get_variable('PERF_MEASUREMENTS', 'JSON-encoded measurements'))
-    launcher = get_variable('PERF_LAUNCHER', 'launcher command').split()
+    # Parse inputs. Read them from a single snapshot of the environment,
+    # so they are consistent even if the environment changes meanwhile.
+    env = os.environ.copy()
+    owner = get_variable(env, 'PERF_OWNER', 'Github respository owner')
+    repository = get_variable(env, 'PERF_REPOSITORY', 'Github respository name')
+    access_token = get_variable(env, 'PERF_ACCESS_TOKEN', 'Github access token')
+    metadata = json_loads(
+        get_variable(env, 'PERF_METADATA', 'JSON-encoded metadata'))
+    measurements = json_loads(
+        get_variable(env, 'PERF_MEASUREMENTS', 'JSON-encoded measurements'))
+    launcher = get_variable(env, 'PERF_LAUNCHER', 'launcher command').split()
+    local_directory = get_variable(
+        env, 'PERF_LOCAL_DIRECTORY', 'directory for local copies of results',
+        os.path.join(tempfile.gettempdir(), 'perf-measurements'))
 
     # Validate inputs.
     if 'benchmark' not in measurements:
@@ -127,15 +161,26 @@ def driver():
     if 'argv' not in measurements:
         raise Exception('Malformed measurements: Measurement "argv" is required')
 
+    # Parse measurements.
+    measurements = dict(
+        (key, parse_measurement(value)) for key, value in measurements.items())
+
     # Run command.
     args = sys.argv[1:]
     command = launcher + args
     output = cmd(command)
 
-    # Capture measurements.
-    measurement_data = {}
-    for key, value in measurements.items():
-        measurement_data[key] = get_measurement(value, args, output)
+    # Capture measurements. These are independent, and some spawn
+    # commands of their own, so take them in parallel.
+    pool = multiprocessing.pool.ThreadPool(min(8, len(measurements)))
+    try:
+        pending = dict(
+            (key, pool.apply_async(measurement.measure, (args, output)))
+            for key, measurement in measurements.items())
+        measurement_data = dict(
+            (key, result.get()) for key, result in pending.items())
+    finally:
+        pool.terminate()
 
     # Build result.
     # Move benchmark and argv into metadata from measurements.
@@ -153,10 +198,15 @@ def driver():
     print()
     print('"measurements":', json.dumps(measurement_data, indent=4, sort_keys=True))
 
+    # Save a local copy of the result first, so it survives a failed upload.
+    path = os.path.join('measurements', metadata['benchmark'], '%s.json' % metadata['date'])
+    content = json.dumps(result, separators=(',', ':'))
+    local_path = save_result_file(local_directory, path, content)
+    print('Saved result to %s' % local_path)
+
     # Insert result into target repository.
     repo = get_repository(owner, repository, access_token)
-    path = os.path.join('measurements', metadata['benchmark'], '%s.json' % metadata['date'])
-    create_result_file(repo, path, result)
+    create_result_file(repo, path, content)
 
 if __name__ == '__main__':
     driver()
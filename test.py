@@ -350,6 +350,11 @@ def run_test_perf(launcher, root_dir, tmp_dir, bin_dir, env, thread_count):
         ('PERF_OWNER', 'StanfordLegion'),
         ('PERF_REPOSITORY', 'perf-data'),
         ('PERF_METADATA', json.dumps(metadata)),
+        # Keep local copies of results outside tmp_dir, which is
+        # removed after the run.
+        ('PERF_LOCAL_DIRECTORY', env.get(
+            'PERF_LOCAL_DIRECTORY',
+            os.path.join(root_dir, 'perf-measurements'))),
     ])
     cxx_env = dict(list(env.items()) + [
         ('PERF_MEASUREMENTS', json.dumps(cxx_measurements)),
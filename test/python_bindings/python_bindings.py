@@ -20,6 +20,11 @@ from __future__ import print_function
 import legion
 import numpy
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
 init = legion.extern_task(task_id=3, privileges=[legion.RW])
 
 @legion.task
@@ -59,6 +64,33 @@ def saxpy(S, a):
     numpy.add(S.y, a*S.x, out=S.y)
     print(S.y[0:10])
 
+@legion.task(privileges=[legion.R], leaf=True)
+def check(S, x, y):
+    print("inside task check%s" % ((S, x, y),))
+
+    assert (S.x == x).all()
+    assert (S.y == y).all()
+
+if numba is not None:
+    @legion.kernel(privileges=[legion.RW], leaf=True)
+    def saxpy_kernel(S, a):
+        for i in range(S.x.shape[0]):
+            S.y[i] += a*S.x[i]
+
+    # Numba doesn't support ndarray.tolist, so this falls back to
+    # running in Python.
+    @legion.kernel(privileges=[legion.R], leaf=True)
+    def print_kernel(S):
+        print(S.x[0:10].tolist())
+
+    # Field names starting with '_' can't be passed to Numba, so this
+    # also runs in Python.
+    @legion.kernel(privileges=[legion.RW], leaf=True)
+    def fill_kernel(T, value):
+        for i in range(T._z.shape[0]):
+            T._z[i] = value
+        assert (T._z == value).all()
+
 @legion.task(inner=True)
 def main_task():
     print("inside main_task()")
@@ -66,6 +98,13 @@ def main_task():
     x = f(1, "asdf", True)
     print("result of f is %s" % x.get())
 
+    # Tunable values are cached, so repeated selects share a future.
+    pys = legion.Tunable.select(legion.Tunable.GLOBAL_PYS)
+    pys_again = legion.Tunable.select(legion.Tunable.GLOBAL_PYS)
+    assert pys is pys_again
+    assert pys.get() == pys_again.get()
+    print("number of Python processors is %s" % pys.get())
+
     R = legion.Region.create([4, 4], {'x': (legion.float64, 1)})
     init(R)
     inc(R, 1)
@@ -73,3 +112,14 @@ def main_task():
     S = legion.Region.create([1000], {'x': legion.float64, 'y': legion.float64})
     fill(S, 10)
     saxpy(S, 2)
+    check(S, 10, 30)
+
+    if numba is not None:
+        saxpy_kernel(S, 2)
+        check(S, 10, 50)
+        print_kernel(S)
+
+        T = legion.Region.create([10], {'_z': legion.float64})
+        fill_kernel(T, 3)
+
+    legion.execution_fence(block=True)